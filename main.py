@@ -3,11 +3,45 @@ import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 import aiohttp
+from aiohttp import web
 from typing import Optional
 import asyncio
-import json
+import atexit
+import contextlib
+import gzip
+import logging
+import logging.handlers
+import queue
+import random
+import secrets
+import signal
+import time
+from collections import deque
+from urllib.parse import quote_plus
 from datetime import datetime
 
+# stdlib json is only needed when orjson isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+# Log records are queued and written to stderr by a listener thread, so
+# coroutines never block on the stream write
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+# No formatter on the QueueHandler - only the listener's stream handler formats
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# INFO for our own logger only; root stays at WARNING so aiohttp's access
+# log (which would record OAuth2 codes and states) stays quiet
+logger = logging.getLogger("authbot")
+logger.setLevel(logging.INFO)
+
 # ----------------------------
 # RENDER-SPECIFIC CONFIGURATION
 # ----------------------------
@@ -48,6 +82,13 @@ CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 # CRITICAL: This must be your Render URL after deployment
 REDIRECT_URI = os.getenv("REDIRECT_URI", "https://your-bot-name.onrender.com/callback")
 
+# OAuth2 authorize URL with guilds.join scope; only the state varies per user
+OAUTH_URL_TEMPLATE = (
+    f"https://discord.com/api/oauth2/authorize?client_id={CLIENT_ID}"
+    f"&redirect_uri={quote_plus(REDIRECT_URI)}&response_type=code"
+    f"&scope=identify+guilds.join&state={{state}}"
+)
+
 # Target server for OAuth2 redirection
 TARGET_SERVER_ID = get_env_int("TARGET_SERVER_ID")
 
@@ -57,29 +98,171 @@ AUTO_KICK_AFTER_ADD = get_env_bool("AUTO_KICK_AFTER_ADD", False)
 # File to store tokens and pending verifications
 TOKENS_FILE = "user_tokens.json"
 PENDING_FILE = "pending_verifications.json"
-OAUTH2_ADDS_FILE = "oauth2_adds_log.json"
+OAUTH2_ADDS_FILE = "oauth2_adds_log.jsonl"  # append-only, one record per line
+LEGACY_OAUTH2_ADDS_FILE = "oauth2_adds_log.json"
+VERIFY_MSG_FILE = "verify_msg.json"
 
 # Load stored data
-def load_json_file(filename, default={}):
+def json_dumps(data, indent: bool = True) -> bytes:
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, indent=2 if indent else None).encode()
+
+def json_loads(raw):
+    if orjson:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def load_json_file(filename, default=None, int_keys: bool = False):
+    if default is None:
+        default = {}
     if os.path.exists(filename):
         try:
-            with open(filename, 'r') as f:
-                return json.load(f)
+            with open(filename, 'rb') as f:
+                data = json_loads(f.read())
+            # JSON object keys are always strings; restore snowflake IDs
+            if int_keys:
+                data = {int(k): v for k, v in data.items()}
+            return data
         except Exception as e:
-            print(f"❌ Error loading {filename}: {e}")
+            logger.error("❌ Error loading %s: %s", filename, e)
             return default
     return default
 
-def save_json_file(filename, data):
+def _atomic_write(filename, payload: bytes):
+    """Write payload to filename via a temp file so a crash never leaves it half-written"""
+    tmp = filename + '.tmp'
     try:
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
     except Exception as e:
-        print(f"❌ Error saving {filename}: {e}")
+        logger.error("❌ Error saving %s: %s", filename, e)
+
+def _append_line(filename, line: bytes):
+    try:
+        with open(filename, 'ab') as f:
+            f.write(line + b'\n')
+    except Exception as e:
+        logger.error("❌ Error appending to %s: %s", filename, e)
+
+def _migrate_legacy_adds_log():
+    """Convert the old {user_id: [records]} JSON log to JSONL once"""
+    if os.path.exists(OAUTH2_ADDS_FILE) or not os.path.exists(LEGACY_OAUTH2_ADDS_FILE):
+        return
+    legacy = load_json_file(LEGACY_OAUTH2_ADDS_FILE)
+    lines = [
+        json_dumps({"user_id": user_id, **record}, indent=False)
+        for user_id, records in legacy.items()
+        for record in records
+    ]
+    _atomic_write(OAUTH2_ADDS_FILE, b''.join(line + b'\n' for line in lines))
+    logger.info("✅ Migrated %s OAuth2 add records to %s", len(lines), OAUTH2_ADDS_FILE)
+
+def _count_adds_by_user(filename, size: int) -> dict:
+    """Stream the first `size` bytes of the adds log and count records per user"""
+    counts = {}
+    if size <= 0:
+        return counts
+    try:
+        with open(filename, 'rb') as f:
+            read = 0
+            for lineno, line in enumerate(f, 1):
+                read += len(line)
+                if read > size:
+                    break
+                if not line.strip():
+                    continue
+                # A torn append only spoils its own line, so skip just that one
+                try:
+                    user_id = int(json_loads(line)["user_id"])
+                except Exception as e:
+                    logger.warning("⚠️ Skipping bad line %s in %s: %s", lineno, filename, e)
+                    continue
+                counts[user_id] = counts.get(user_id, 0) + 1
+    except OSError as e:
+        logger.error("❌ Error reading %s: %s", filename, e)
+    return counts
+
+# Both keyed by int user ID in memory
+user_access_tokens = load_json_file(TOKENS_FILE, int_keys=True)
+pending_verifications = load_json_file(PENDING_FILE, int_keys=True)
+
+# {"channel_id": ..., "message_id": ...} of the posted verification message
+verify_message_cache = load_json_file(VERIFY_MSG_FILE)
+
+# Successful OAuth2 adds per user; filled from the log in the background
+# and bumped incrementally as new records are appended
+_migrate_legacy_adds_log()
+oauth2_add_counts = {}
+
+# Debounced saves: many changes within SAVE_DELAY collapse into one write
+SAVE_DELAY = 0.5
+JSON_FILES = {
+    TOKENS_FILE: user_access_tokens,
+    PENDING_FILE: pending_verifications,
+    VERIFY_MSG_FILE: verify_message_cache,
+}
+_dirty_files = set()
+_save_tasks = {}
+
+def schedule_save(filename):
+    """Mark a data file as changed; it is written off the event loop shortly after"""
+    _dirty_files.add(filename)
+    if filename not in _save_tasks:
+        _save_tasks[filename] = asyncio.create_task(_flush_after(filename))
+
+async def _flush_after(filename):
+    loop = asyncio.get_running_loop()
+    while filename in _dirty_files:
+        await asyncio.sleep(SAVE_DELAY)
+        _dirty_files.discard(filename)
+        # Encode on the loop so the dict can't change mid-dump, write in a thread
+        payload = json_dumps(JSON_FILES[filename])
+        await loop.run_in_executor(None, _atomic_write, filename, payload)
+    del _save_tasks[filename]
 
-user_access_tokens = load_json_file(TOKENS_FILE)
-pending_verifications = load_json_file(PENDING_FILE)
-oauth2_adds_log = load_json_file(OAUTH2_ADDS_FILE)
+_ts_cache = (0, "")
+
+def iso_now() -> str:
+    """UTC ISO timestamp, formatted at most once per second"""
+    global _ts_cache
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache = (now, datetime.utcfromtimestamp(now).isoformat())
+    return _ts_cache[1]
+
+async def load_oauth2_add_counts():
+    """Count existing log records off the event loop"""
+    # Only read what exists now; later appends are counted as they happen
+    size = os.path.getsize(OAUTH2_ADDS_FILE) if os.path.exists(OAUTH2_ADDS_FILE) else 0
+    counts = await asyncio.get_running_loop().run_in_executor(
+        None, _count_adds_by_user, OAUTH2_ADDS_FILE, size
+    )
+    for user_id, count in counts.items():
+        oauth2_add_counts[user_id] = oauth2_add_counts.get(user_id, 0) + count
+    logger.info("📨 Loaded %s OAuth2 add records", sum(counts.values()))
+
+async def log_oauth2_add(user_id: int, guild_id: int, method: str):
+    """Append one OAuth2 add record to the log"""
+    record = {
+        "user_id": str(user_id),
+        "timestamp": iso_now(),
+        "guild_id": guild_id,
+        "method": method
+    }
+    oauth2_add_counts[user_id] = oauth2_add_counts.get(user_id, 0) + 1
+    await asyncio.get_running_loop().run_in_executor(
+        None, _append_line, OAUTH2_ADDS_FILE, json_dumps(record, indent=False)
+    )
+
+async def flush_saves():
+    """Wait for all pending debounced saves to hit disk"""
+    if _save_tasks:
+        await asyncio.gather(*_save_tasks.values(), return_exceptions=True)
 
 # ----------------------------
 # Bot setup
@@ -89,21 +272,156 @@ intents.members = True
 intents.message_content = True
 intents.guilds = True
 
-print("="*60)
-print("🤖 DISCORD OAUTH2 REDIRECTION BOT - RENDER EDITION")
-print("="*60)
-print(f"✅ Bot starting on port: {PORT}")
-print(f"🌐 Callback URL: {REDIRECT_URI}")
-print(f"🔧 Client ID: {CLIENT_ID}")
-print(f"🎯 Target Server ID: {TARGET_SERVER_ID}")
-print(f"🔑 Users with tokens: {len(user_access_tokens)}")
-print(f"⏳ Pending verifications: {len(pending_verifications)}")
+logger.info(
+    "🤖 DISCORD OAUTH2 REDIRECTION BOT - RENDER EDITION\n"
+    "✅ Bot starting on port: %s\n"
+    "🌐 Callback URL: %s\n"
+    "🔧 Client ID: %s\n"
+    "🎯 Target Server ID: %s\n"
+    "🔑 Users with tokens: %s\n"
+    "⏳ Pending verifications: %s",
+    PORT, REDIRECT_URI, CLIENT_ID, TARGET_SERVER_ID,
+    len(user_access_tokens), len(pending_verifications)
+)
 
 bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
 
+# IDs of members holding the Verified role in GUILD_ID; hydrated in on_ready
+# and kept current by on_member_update/on_member_remove
+VERIFIED: set[int] = set()
+
+# Shared HTTP session for all Discord API calls (created in main)
+HTTP: Optional[aiohttp.ClientSession] = None
+
+DISCORD_TOKEN_URL = 'https://discord.com/api/oauth2/token'
+DISCORD_USERINFO_URL = 'https://discord.com/api/users/@me'
+
+# The user is waiting on the callback page for these, so fail faster than
+# the session-wide 30s default
+CALLBACK_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
 # ----------------------------
 # OAuth2 Helper Functions
 # ----------------------------
+# Opaque OAuth2 state -> (user_id, guild_id, expires_at); in memory only
+STATE_TTL = 600
+PENDING_STATES: dict[str, tuple[int, int, float]] = {}
+
+def new_oauth_state(user_id: int, guild_id: int) -> str:
+    """Issue a random state for an authorize URL and remember who it belongs to"""
+    state = secrets.token_urlsafe(24)
+    PENDING_STATES[state] = (user_id, guild_id, time.monotonic() + STATE_TTL)
+    return state
+
+def consume_oauth_state(state: Optional[str]) -> Optional[tuple[int, int]]:
+    """
+    Pop a state issued by new_oauth_state; None if unknown, reused or expired
+    
+    This only proves we issued the link - a forwarded link can be completed
+    by another account, so complete_verification still checks the token's owner
+    """
+    entry = PENDING_STATES.pop(state, None) if state else None
+    if entry is None or entry[2] < time.monotonic():
+        return None
+    return entry[0], entry[1]
+
+async def sweep_expired_states():
+    """Drop states for authorize links that were never completed"""
+    while True:
+        await asyncio.sleep(60)
+        now = time.monotonic()
+        for state in [s for s, entry in PENDING_STATES.items() if entry[2] < now]:
+            del PENDING_STATES[state]
+
+class RateLimiter:
+    """
+    Client-side limiter for our own Discord REST calls (discord.py limits its own)
+    
+    Proactive: at most `limit` requests per `window` seconds across all
+    routes (Discord's global limit), and a route is held back until reset
+    once its X-RateLimit-Remaining runs low. A 429 flagged
+    X-RateLimit-Global holds back every route.
+    Reactive (AIMD): each 429 halves the number of requests allowed in
+    flight, each success adds 0.5 back, up to `c_max`.
+    """
+    def __init__(self, limit: int = 50, window: float = 1.0, c_max: int = 10):
+        self.limit = limit
+        self.window = window
+        self.c_max = c_max
+        self.cap = float(c_max)
+        self.in_flight = 0
+        self._window: deque = deque()  # shared by all routes
+        self._blocked_until: dict[str, float] = {}
+        self._global_blocked_until = 0.0
+        self._cond = asyncio.Condition()
+    
+    def _delay(self, route: str, now: float) -> float:
+        """Seconds until `route` may send, from header blocks and the shared window"""
+        window = self._window
+        while window and window[0] <= now - self.window:
+            window.popleft()
+        delay = max(self._blocked_until.get(route, 0.0), self._global_blocked_until) - now
+        if len(window) >= self.limit:
+            delay = max(delay, window[0] + self.window - now)
+        return delay
+    
+    async def wait_if_throttled(self, route: str):
+        while True:
+            delay = self._delay(route, time.monotonic())
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+    
+    @contextlib.asynccontextmanager
+    async def slot(self, route: str):
+        """
+        Hold one in-flight request slot for `route`
+        
+        Throttling is waited out before a slot is taken, so requests sleeping
+        on a blocked route never hold up other routes
+        """
+        while True:
+            await self.wait_if_throttled(route)
+            async with self._cond:
+                await self._cond.wait_for(lambda: self.in_flight < int(self.cap))
+                # Another request may have used the window or hit a 429 meanwhile
+                now = time.monotonic()
+                if self._delay(route, now) <= 0:
+                    self.in_flight += 1
+                    self._window.append(now)
+                    break
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+    
+    def observe(self, route: str, status: int, headers):
+        """Update limits from a response's status and rate limit headers"""
+        now = time.monotonic()
+        try:
+            if status == 429:
+                retry_after = float(headers.get('Retry-After') or 1)
+                if headers.get('X-RateLimit-Global'):
+                    self._global_blocked_until = now + retry_after
+                else:
+                    self._blocked_until[route] = now + retry_after
+                self.cap = max(1.0, self.cap * 0.5)
+                return
+            
+            remaining = headers.get('X-RateLimit-Remaining')
+            reset_after = headers.get('X-RateLimit-Reset-After')
+            if remaining is not None and reset_after and int(remaining) <= 2:
+                self._blocked_until[route] = now + float(reset_after)
+        except ValueError:
+            pass
+        
+        if status < 400:
+            self.cap = min(float(self.c_max), self.cap + 0.5)
+
+DISCORD_LIMITER = RateLimiter()
+
 async def exchange_code_for_token(code: str) -> Optional[dict]:
     """Exchange OAuth2 code for access token"""
     try:
@@ -119,18 +437,19 @@ async def exchange_code_for_token(code: str) -> Optional[dict]:
             'Content-Type': 'application/x-www-form-urlencoded'
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post('https://discord.com/api/oauth2/token', data=data, headers=headers) as resp:
-                print(f"🔑 Token exchange status: {resp.status}")
-                if resp.status == 200:
-                    token_data = await resp.json()
-                    print(f"✅ Token received: {token_data.get('access_token', '')[:20]}...")
-                    return token_data
-                else:
-                    error_text = await resp.text()
-                    print(f"❌ Token exchange failed: {resp.status} - {error_text}")
+        async with DISCORD_LIMITER.slot('oauth2_token'), \
+                HTTP.post(DISCORD_TOKEN_URL, data=data, headers=headers, timeout=CALLBACK_TIMEOUT) as resp:
+            DISCORD_LIMITER.observe('oauth2_token', resp.status, resp.headers)
+            logger.debug("🔑 Token exchange status: %s", resp.status)
+            if resp.status == 200:
+                token_data = await resp.json(loads=json_loads)
+                logger.debug("✅ Token received: %s...", token_data.get('access_token', '')[:20])
+                return token_data
+            else:
+                error_text = await resp.text()
+                logger.error("❌ Token exchange failed: %s - %s", resp.status, error_text)
     except Exception as e:
-        print(f"❌ Token exchange error: {e}")
+        logger.error("❌ Token exchange error: %s", e)
     return None
 
 async def get_user_info(access_token: str) -> Optional[dict]:
@@ -138,17 +457,18 @@ async def get_user_info(access_token: str) -> Optional[dict]:
     try:
         headers = {'Authorization': f'Bearer {access_token}'}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://discord.com/api/users/@me', headers=headers) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    print(f"❌ User info failed: {resp.status}")
+        async with DISCORD_LIMITER.slot('users_me'), \
+                HTTP.get(DISCORD_USERINFO_URL, headers=headers, timeout=CALLBACK_TIMEOUT) as resp:
+            DISCORD_LIMITER.observe('users_me', resp.status, resp.headers)
+            if resp.status == 200:
+                return await resp.json(loads=json_loads)
+            else:
+                logger.error("❌ User info failed: %s", resp.status)
     except Exception as e:
-        print(f"❌ User info error: {e}")
+        logger.error("❌ User info error: %s", e)
     return None
 
-async def add_user_to_guild_via_oauth2(user_id: str, access_token: str, guild_id: int) -> bool:
+async def add_user_to_guild_via_oauth2(user_id: int, access_token: str, guild_id: int) -> bool:
     """
     DIRECT OAuth2 REDIRECTION: Add user to a guild using OAuth2 guilds.join scope
     """
@@ -158,98 +478,117 @@ async def add_user_to_guild_via_oauth2(user_id: str, access_token: str, guild_id
             'Content-Type': 'application/json'
         }
         
-        data = {'access_token': access_token}
+        # Body is the same for every retry, so encode it once
+        data = json_dumps({'access_token': access_token}, indent=False)
+        
+        logger.info("🔄 OAuth2 Adding user %s to guild %s", user_id, guild_id)
+        logger.debug("📝 Using token: %s...", access_token[:30])
         
-        print(f"\n🔄 OAuth2 Adding user {user_id} to guild {guild_id}")
-        print(f"📝 Using token: {access_token[:30]}...")
+        # Discord buckets this route per guild
+        route = f'guild_member_put:{guild_id}'
         
-        async with aiohttp.ClientSession() as session:
-            async with session.put(
+        attempts = 8
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            async with DISCORD_LIMITER.slot(route), HTTP.put(
                 f'https://discord.com/api/v10/guilds/{guild_id}/members/{user_id}',
                 headers=headers,
-                json=data
+                data=data
             ) as resp:
                 
                 status = resp.status
                 response_text = await resp.text()
+                reset_after = resp.headers.get('X-RateLimit-Reset-After')
+                retry_after = resp.headers.get('Retry-After')
+                DISCORD_LIMITER.observe(route, status, resp.headers)
+            
+            logger.debug("📡 Response status: %s", status)
+            
+            if status == 429:  # Rate limited - wait as long as Discord tells us
+                if last_attempt:
+                    break
+                if not retry_after:
+                    try:
+                        retry_after = json_loads(response_text).get('retry_after')
+                    except ValueError:
+                        pass
+                wait = float(retry_after or reset_after or 1) + random.random() * 0.25
+                logger.warning("⏳ Rate limited, retrying in %.2fs (attempt %s/%s)", wait, attempt + 1, attempts)
+                await asyncio.sleep(wait)
+                continue
+            
+            if status >= 500:  # Discord-side error - exponential backoff with jitter
+                if last_attempt:
+                    break
+                wait = min(2 ** attempt, 30) + random.random()
+                logger.warning("⏳ Server error %s, retrying in %.2fs (attempt %s/%s)", status, wait, attempt + 1, attempts)
+                await asyncio.sleep(wait)
+                continue
+            
+            if status in [200, 201]:  # Success - user added
+                logger.info("✅ OAuth2 ADD SUCCESS: User %s added to guild %s", user_id, guild_id)
                 
-                print(f"📡 Response status: {status}")
+                # Log the successful add
+                await log_oauth2_add(user_id, guild_id, "oauth2_guilds_join")
                 
-                if status in [200, 201]:  # Success - user added
-                    print(f"✅ OAuth2 ADD SUCCESS: User {user_id} added to guild {guild_id}")
-                    
-                    # Log the successful add
-                    if user_id not in oauth2_adds_log:
-                        oauth2_adds_log[user_id] = []
-                    oauth2_adds_log[user_id].append({
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "guild_id": guild_id,
-                        "method": "oauth2_guilds_join"
-                    })
-                    save_json_file(OAUTH2_ADDS_FILE, oauth2_adds_log)
-                    
-                    return True
-                    
-                elif status == 204:  # User already in guild
-                    print(f"⚠️ User {user_id} already in guild {guild_id}")
-                    
-                    # Still log as success
-                    if user_id not in oauth2_adds_log:
-                        oauth2_adds_log[user_id] = []
-                    oauth2_adds_log[user_id].append({
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "guild_id": guild_id,
-                        "method": "already_member"
-                    })
-                    save_json_file(OAUTH2_ADDS_FILE, oauth2_adds_log)
-                    
-                    return True
-                    
-                elif status == 403:  # Forbidden
-                    print(f"❌ OAuth2 ADD FAILED: Bot lacks permissions")
-                    print(f"   Response: {response_text}")
-                    return False
-                    
-                else:  # Other error
-                    print(f"❌ OAuth2 ADD FAILED: Status {status} - {response_text}")
-                    return False
-                    
-    except Exception as e:
-        print(f"❌ OAuth2 guild add error: {e}")
-        import traceback
-        traceback.print_exc()
+                return True
+                
+            elif status == 204:  # User already in guild
+                logger.warning("⚠️ User %s already in guild %s", user_id, guild_id)
+                
+                # Still log as success
+                await log_oauth2_add(user_id, guild_id, "already_member")
+                
+                return True
+                
+            elif status == 403:  # Forbidden
+                logger.error("❌ OAuth2 ADD FAILED: Bot lacks permissions - %s", response_text)
+                return False
+                
+            else:  # Other error
+                logger.error("❌ OAuth2 ADD FAILED: Status %s - %s", status, response_text)
+                return False
+        
+        logger.error("❌ OAuth2 ADD FAILED: Gave up on user %s after %s attempts", user_id, attempts)
+                
+    except Exception:
+        logger.exception("❌ OAuth2 guild add error for user %s", user_id)
     return False
 
+def verified_roles_for(member: discord.Member, verified_role: discord.Role) -> list:
+    """Member's roles with unverified swapped for verified, for a single member.edit call"""
+    return [
+        r for r in member.roles
+        if not r.is_default() and r.id not in (UNVERIFIED_ROLE_ID, VERIFIED_ROLE_ID)
+    ] + [verified_role]
+
 async def verify_user_in_guild(user_id: int, guild_id: int):
     """Give verified role to user in specific guild"""
     guild = bot.get_guild(guild_id)
     if not guild:
-        print(f"❌ Guild {guild_id} not found")
+        logger.error("❌ Guild %s not found", guild_id)
         return False
     
     member = guild.get_member(user_id)
     if not member:
-        print(f"❌ User {user_id} not in guild {guild_id}")
+        logger.error("❌ User %s not in guild %s", user_id, guild_id)
         return False
     
     verified_role = guild.get_role(VERIFIED_ROLE_ID)
-    unverified_role = guild.get_role(UNVERIFIED_ROLE_ID)
     
     if not verified_role:
-        print(f"❌ Verified role not found in guild {guild_id}")
+        logger.error("❌ Verified role not found in guild %s", guild_id)
         return False
     
     try:
-        # Remove unverified role if present
-        if unverified_role and unverified_role in member.roles:
-            await member.remove_roles(unverified_role)
-        
-        # Add verified role
-        await member.add_roles(verified_role)
-        print(f"✅ Verified {member.name} ({member.id}) in guild {guild.name}")
+        # Remove unverified and add verified in one request
+        await member.edit(roles=verified_roles_for(member, verified_role), reason="OAuth2 verified")
+        if guild_id == GUILD_ID:
+            VERIFIED.add(user_id)
+        logger.info("✅ Verified %s (%s) in guild %s", member.name, member.id, guild.name)
         return True
     except Exception as e:
-        print(f"❌ Failed to verify {member.name}: {e}")
+        logger.error("❌ Failed to verify %s: %s", member.name, e)
         return False
 
 # ----------------------------
@@ -264,11 +603,11 @@ class StartVerifyButton(discord.ui.View):
         member = interaction.user
         guild = interaction.guild
         
-        print(f"\n🔔 Verification button clicked by {member.name} ({member.id})")
+        logger.info("🔔 Verification button clicked by %s (%s)", member.name, member.id)
         
         # Check if already verified
         verified_role = guild.get_role(VERIFIED_ROLE_ID)
-        if verified_role and verified_role in member.roles:
+        if verified_role and member.get_role(VERIFIED_ROLE_ID) is not None:
             return await interaction.response.send_message(
                 "✅ You're already verified!", ephemeral=True
             )
@@ -281,24 +620,23 @@ class StartVerifyButton(discord.ui.View):
             )
         
         # Give unverified role if not already
-        if unverified_role not in member.roles:
+        if member.get_role(UNVERIFIED_ROLE_ID) is None:
             try:
                 await member.add_roles(unverified_role)
             except Exception as e:
-                print(f"❌ Cannot assign roles: {e}")
+                logger.error("❌ Cannot assign roles: %s", e)
                 return await interaction.response.send_message(
                     "❌ Cannot assign roles!", ephemeral=True
                 )
         
         # Create OAuth2 URL with guilds.join scope
-        state_data = f"{member.id}:{guild.id}"
-        oauth_url = f"https://discord.com/api/oauth2/authorize?client_id={CLIENT_ID}&redirect_uri={REDIRECT_URI}&response_type=code&scope=identify+guilds.join&state={state_data}"
+        oauth_url = OAUTH_URL_TEMPLATE.format(state=new_oauth_state(member.id, guild.id))
         
         # Store pending verification
-        pending_verifications[str(member.id)] = guild.id
-        save_json_file(PENDING_FILE, pending_verifications)
+        pending_verifications[member.id] = guild.id
+        schedule_save(PENDING_FILE)
         
-        print(f"📝 Stored pending verification for {member.id} in guild {guild.id}")
+        logger.info("📝 Stored pending verification for %s in guild %s", member.id, guild.id)
         
         # Send DM with authorization link
         embed = discord.Embed(
@@ -319,12 +657,12 @@ class StartVerifyButton(discord.ui.View):
         
         try:
             await member.send(embed=embed)
-            print(f"📨 DM sent to {member.name}")
+            logger.info("📨 DM sent to %s", member.name)
             await interaction.response.send_message(
                 "📩 Check your DMs to complete verification!", ephemeral=True
             )
         except Exception as e:
-            print(f"❌ Could not send DM: {e}")
+            logger.error("❌ Could not send DM: %s", e)
             await interaction.response.send_message(
                 f"{member.mention}, please enable DMs to complete verification!",
                 ephemeral=True
@@ -335,54 +673,56 @@ class StartVerifyButton(discord.ui.View):
 # ----------------------------
 async def complete_verification(user_id: int, access_token: str):
     """Complete verification after OAuth2 authorization"""
-    print(f"\n🔄 [VERIFICATION] Starting verification for user {user_id}")
+    logger.info("🔄 [VERIFICATION] Starting verification for user %s", user_id)
     
     # Get user info
     user_info = await get_user_info(access_token)
     if not user_info:
-        print(f"❌ [VERIFICATION] Failed to get user info for {user_id}")
+        logger.error("❌ [VERIFICATION] Failed to get user info for %s", user_id)
         return False
     
     username = user_info.get('username', 'Unknown')
     user_id_from_token = user_info.get('id')
     
-    print(f"🔄 [VERIFICATION] Got user info: {username} (ID from token: {user_id_from_token})")
+    logger.info("🔄 [VERIFICATION] Got user info: %s (ID from token: %s)", username, user_id_from_token)
     
     # Ensure user IDs match
-    if str(user_id) != str(user_id_from_token):
-        print(f"⚠️ [VERIFICATION] User ID mismatch! Expected {user_id}, got {user_id_from_token}")
+    if user_id != int(user_id_from_token):
+        logger.warning("⚠️ [VERIFICATION] User ID mismatch! Expected %s, got %s", user_id, user_id_from_token)
         user_id = int(user_id_from_token)
     
     # Check if this user has a pending verification
-    user_id_str = str(user_id)
-    
-    if user_id_str in pending_verifications:
-        print(f"✅ [VERIFICATION] User has pending verification")
-        guild_id = pending_verifications[user_id_str]
+    if user_id in pending_verifications:
+        logger.info("✅ [VERIFICATION] User has pending verification")
+        guild_id = pending_verifications[user_id]
         
-        # Verify user in that guild
-        success = await verify_user_in_guild(user_id, guild_id)
+        # Verify user in that guild - no role edit needed on a repeat authorization
+        if guild_id == GUILD_ID and user_id in VERIFIED:
+            logger.info("✅ [VERIFICATION] %s already verified, skipping role update", username)
+            success = True
+        else:
+            success = await verify_user_in_guild(user_id, guild_id)
         
         if success:
             # Remove from pending
-            del pending_verifications[user_id_str]
-            save_json_file(PENDING_FILE, pending_verifications)
+            del pending_verifications[user_id]
+            schedule_save(PENDING_FILE)
             
             # Store token FOR OAuth2 REDIRECTION
-            user_access_tokens[user_id_str] = access_token
-            save_json_file(TOKENS_FILE, user_access_tokens)
+            user_access_tokens[user_id] = access_token
+            schedule_save(TOKENS_FILE)
             
-            print(f"✅ [VERIFICATION] Verification completed for {username}")
-            print(f"✅ [VERIFICATION] Token stored: {access_token[:20]}...")
+            logger.info("✅ [VERIFICATION] Verification completed for %s", username)
+            logger.debug("✅ [VERIFICATION] Token stored: %s...", access_token[:20])
             return True
         else:
-            print(f"❌ [VERIFICATION] Failed to verify {username} in guild")
+            logger.error("❌ [VERIFICATION] Failed to verify %s in guild", username)
     else:
-        print(f"⚠️ [VERIFICATION] No pending verification for {username}, storing token only")
+        logger.warning("⚠️ [VERIFICATION] No pending verification for %s, storing token only", username)
         # Store token anyway for future OAuth2 redirection
-        user_access_tokens[user_id_str] = access_token
-        save_json_file(TOKENS_FILE, user_access_tokens)
-        print(f"✅ [VERIFICATION] Token stored anyway: {access_token[:20]}...")
+        user_access_tokens[user_id] = access_token
+        schedule_save(TOKENS_FILE)
+        logger.debug("✅ [VERIFICATION] Token stored anyway: %s...", access_token[:20])
     
     return False
 
@@ -401,20 +741,19 @@ async def verify_command(ctx):
     member = ctx.author
     guild = ctx.guild
     
-    print(f"\n🔔 !verify command used by {member.name} ({member.id})")
+    logger.info("🔔 !verify command used by %s (%s)", member.name, member.id)
     
     # Check if already verified
     verified_role = guild.get_role(VERIFIED_ROLE_ID)
-    if verified_role and verified_role in member.roles:
+    if verified_role and member.get_role(VERIFIED_ROLE_ID) is not None:
         return await ctx.send("✅ You're already verified!")
     
     # Create OAuth2 URL WITH guilds.join scope
-    state_data = f"{member.id}:{guild.id}"
-    oauth_url = f"https://discord.com/api/oauth2/authorize?client_id={CLIENT_ID}&redirect_uri={REDIRECT_URI}&response_type=code&scope=identify+guilds.join&state={state_data}"
+    oauth_url = OAUTH_URL_TEMPLATE.format(state=new_oauth_state(member.id, guild.id))
     
     # Store pending
-    pending_verifications[str(member.id)] = guild.id
-    save_json_file(PENDING_FILE, pending_verifications)
+    pending_verifications[member.id] = guild.id
+    schedule_save(PENDING_FILE)
     
     embed = discord.Embed(
         title="🔐 Complete Verification",
@@ -434,52 +773,57 @@ async def add_user_command(ctx, member: discord.Member):
     """
     DIRECT OAuth2 REDIRECTION: Add verified user to target server
     """
-    print(f"\n🔔 !add command for {member.name} ({member.id})")
+    logger.info("🔔 !add command for %s (%s)", member.name, member.id)
     
     # Check if user is verified
     verified_role = ctx.guild.get_role(VERIFIED_ROLE_ID)
     if not verified_role:
         return await ctx.send("❌ Verified role not found!")
     
-    if verified_role not in member.roles:
+    if member.get_role(VERIFIED_ROLE_ID) is None:
         return await ctx.send(f"❌ {member.mention} is not verified! Use `!verify` first.")
     
     # Check if user has authorized with guilds.join scope
-    user_id_str = str(member.id)
-    if user_id_str not in user_access_tokens:
+    if member.id not in user_access_tokens:
         return await ctx.send(
             f"❌ {member.mention} hasn't completed OAuth2 authorization!\n"
             f"They need to use `!verify` or the verification button and grant **'Join servers for you'** permission."
         )
     
-    access_token = user_access_tokens[user_id_str]
-    print(f"🔑 Found token for user {member.id}: {access_token[:30]}...")
+    access_token = user_access_tokens[member.id]
+    logger.debug("🔑 Found token for user %s: %s...", member.id, access_token[:30])
     
     status_msg = await ctx.send(f"🔄 **OAuth2 Redirection:** Adding {member.mention} to target server...")
     
     # Perform OAuth2 guild add
-    success = await add_user_to_guild_via_oauth2(user_id_str, access_token, TARGET_SERVER_ID)
+    success = await add_user_to_guild_via_oauth2(member.id, access_token, TARGET_SERVER_ID)
     
     if success:
         response = f"✅ **OAuth2 ADD SUCCESS:** {member.mention} has been added to the target server!"
         
-        # Optional: Auto-kick after successful add
+        # Notify user and (optionally) auto-kick concurrently - neither depends on the other
+        target_guild = bot.get_guild(TARGET_SERVER_ID)
+        server_name = target_guild.name if target_guild else "the target server"
+        dm_task = asyncio.create_task(
+            member.send(f"✅ **Server Transfer Complete:** You've been added to **{server_name}** via OAuth2.")
+        )
+        kick_task = None
         if AUTO_KICK_AFTER_ADD:
-            try:
-                await member.kick(reason="OAuth2 redirection to target server completed")
+            kick_task = asyncio.create_task(member.kick(reason="OAuth2 redirection to target server completed"))
+        
+        # DM failures are ignored, as before
+        await asyncio.gather(*(t for t in (dm_task, kick_task) if t), return_exceptions=True)
+        
+        if kick_task:
+            kick_error = kick_task.exception()
+            if kick_error is None:
                 response += f"\n🚪 User has been kicked from this server."
-            except discord.Forbidden:
+            elif isinstance(kick_error, discord.Forbidden):
                 response += f"\n⚠️ Could not kick user (insufficient permissions)."
+            else:
+                response += f"\n⚠️ Could not kick user: {kick_error}"
         
         await status_msg.edit(content=response)
-        
-        # Try to notify user
-        try:
-            target_guild = bot.get_guild(TARGET_SERVER_ID)
-            server_name = target_guild.name if target_guild else "the target server"
-            await member.send(f"✅ **Server Transfer Complete:** You've been added to **{server_name}** via OAuth2.")
-        except:
-            pass
             
     else:
         await status_msg.edit(content=f"❌ **OAuth2 ADD FAILED:** Could not add {member.mention} to target server.\nBot may lack 'guilds.join' scope or user revoked permissions.")
@@ -493,30 +837,27 @@ async def add_all_command(ctx):
     if not verified_role:
         return await ctx.send("❌ Verified role not found!")
     
-    verified_members = [m for m in verified_role.members if str(m.id) in user_access_tokens]
+    verified_members = verified_role.members
+    candidates = [(m, user_access_tokens[m.id]) for m in verified_members if m.id in user_access_tokens]
     
-    if not verified_members:
+    if not candidates:
         return await ctx.send("❌ No verified users with OAuth2 tokens found!")
     
-    status_msg = await ctx.send(f"🔄 **Batch OAuth2 Redirection:** Starting... ({len(verified_members)} users)")
+    status_msg = await ctx.send(f"🔄 **Batch OAuth2 Redirection:** Starting... ({len(candidates)} users)")
     
     success_count = 0
     fail_count = 0
-    no_token_count = 0
+    no_token_count = len(verified_members) - len(candidates)
+    done_count = 0
+    last_edit = 0.0
     
-    for i, member in enumerate(verified_members):
-        user_id_str = str(member.id)
-        access_token = user_access_tokens.get(user_id_str)
-        
-        if not access_token:
-            no_token_count += 1
-            continue
-        
-        # Update status every 3 users
-        if i % 3 == 0:
-            await status_msg.edit(content=f"🔄 **Batch OAuth2:** Processing {i+1}/{len(verified_members)}...")
-        
-        success = await add_user_to_guild_via_oauth2(user_id_str, access_token, TARGET_SERVER_ID)
+    # Limit concurrent joins; Discord's rate limit headers pace the rest
+    sem = asyncio.Semaphore(5)
+    
+    async def worker(member, access_token):
+        nonlocal success_count, fail_count, done_count, last_edit
+        async with sem:
+            success = await add_user_to_guild_via_oauth2(member.id, access_token, TARGET_SERVER_ID)
         
         if success:
             success_count += 1
@@ -530,8 +871,17 @@ async def add_all_command(ctx):
         else:
             fail_count += 1
         
-        # Rate limiting delay
-        await asyncio.sleep(1.5)
+        # Update status at most every 5 seconds (message edits are rate limited too)
+        done_count += 1
+        now = time.monotonic()
+        if now - last_edit > 5:
+            last_edit = now
+            await status_msg.edit(content=f"🔄 **Batch OAuth2:** Processed {done_count}/{len(candidates)}...")
+    
+    results = await asyncio.gather(*(worker(m, token) for m, token in candidates), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("❌ Batch OAuth2 worker error: %s", result)
     
     # Final report
     report = (
@@ -549,18 +899,13 @@ async def force_verify_command(ctx, member: discord.Member):
     """Force verify a user (admin only)"""
     
     verified_role = ctx.guild.get_role(VERIFIED_ROLE_ID)
-    unverified_role = ctx.guild.get_role(UNVERIFIED_ROLE_ID)
     
     if not verified_role:
         return await ctx.send("❌ Verified role not found!")
     
     try:
-        # Remove unverified if present
-        if unverified_role and unverified_role in member.roles:
-            await member.remove_roles(unverified_role)
-        
-        # Add verified
-        await member.add_roles(verified_role)
+        # Remove unverified and add verified in one request
+        await member.edit(roles=verified_roles_for(member, verified_role), reason=f"Force-verified by {ctx.author}")
         await ctx.send(f"✅ **{member.display_name}** force-verified!")
     except Exception as e:
         await ctx.send(f"❌ Failed: {e}")
@@ -579,8 +924,8 @@ async def check_pending_command(ctx):
         color=discord.Color.orange()
     )
     
-    for user_id_str, guild_id in list(pending_verifications.items())[:10]:
-        member = ctx.guild.get_member(int(user_id_str))
+    for user_id, guild_id in list(pending_verifications.items())[:10]:
+        member = ctx.guild.get_member(user_id)
         if member:
             embed.add_field(
                 name=member.display_name,
@@ -598,11 +943,8 @@ async def check_auth_command(ctx):
     if not user_access_tokens:
         return await ctx.send("❌ No OAuth2 authorizations yet.")
     
-    authorized_in_guild = []
-    for user_id_str in user_access_tokens.keys():
-        member = ctx.guild.get_member(int(user_id_str))
-        if member:
-            authorized_in_guild.append(member.mention)
+    ids_in_guild = user_access_tokens.keys() & {m.id for m in ctx.guild.members}
+    authorized_in_guild = [ctx.guild.get_member(i).mention for i in ids_in_guild]
     
     if not authorized_in_guild:
         return await ctx.send("❌ No authorized users in this server.")
@@ -622,8 +964,8 @@ async def token_status_command(ctx, member: Optional[discord.Member] = None):
     """Check if a user has OAuth2 token for redirection"""
     
     if member:
-        has_token = str(member.id) in user_access_tokens
-        token_count = len(oauth2_adds_log.get(str(member.id), []))
+        has_token = member.id in user_access_tokens
+        token_count = oauth2_add_counts.get(member.id, 0)
         
         embed = discord.Embed(
             title=f"🔑 OAuth2 Token Status: {member.display_name}",
@@ -639,8 +981,8 @@ async def token_status_command(ctx, member: Optional[discord.Member] = None):
     else:
         # Show overall stats
         total_tokens = len(user_access_tokens)
-        total_adds = sum(len(v) for v in oauth2_adds_log.values())
-        unique_redirected = len(oauth2_adds_log)
+        total_adds = sum(oauth2_add_counts.values())
+        unique_redirected = len(oauth2_add_counts)
         
         embed = discord.Embed(
             title="📊 OAuth2 Redirection System Status",
@@ -656,11 +998,9 @@ async def token_status_command(ctx, member: Optional[discord.Member] = None):
 @commands.has_permissions(administrator=True)
 async def debug_token_command(ctx, member: discord.Member):
     """Debug token storage for a specific user"""
-    user_id_str = str(member.id)
-    
     # Check all possible locations
-    has_token = user_id_str in user_access_tokens
-    is_pending = user_id_str in pending_verifications
+    has_token = member.id in user_access_tokens
+    is_pending = member.id in pending_verifications
     
     embed = discord.Embed(title="🔍 Token Debug", color=discord.Color.orange())
     embed.add_field(name="User", value=f"{member.mention}\nID: {member.id}", inline=False)
@@ -668,12 +1008,12 @@ async def debug_token_command(ctx, member: discord.Member):
     embed.add_field(name="Is Pending", value="✅ Yes" if is_pending else "❌ No", inline=True)
     
     if has_token:
-        token = user_access_tokens[user_id_str]
+        token = user_access_tokens[member.id]
         embed.add_field(name="Token", value=f"`{token[:30]}...`", inline=False)
         embed.add_field(name="Token Length", value=str(len(token)), inline=True)
     
     if is_pending:
-        guild_id = pending_verifications[user_id_str]
+        guild_id = pending_verifications[member.id]
         embed.add_field(name="Pending Guild", value=guild_id, inline=True)
     
     await ctx.send(embed=embed)
@@ -705,35 +1045,35 @@ async def check_perms_command(ctx):
     
     await ctx.send(embed=embed)
 
+# Static help embed, built once at import
+ADMIN_COMMANDS = [
+    ("`!add @user`", "**PRIMARY:** OAuth2 add user to target server (aliases: !redirect, !move)"),
+    ("`!addall`", "OAuth2 add ALL verified users to target server"),
+    ("`!force_verify @user`", "Force verify user (no OAuth2)"),
+    ("`!checkauth`", "See users with OAuth2 tokens"),
+    ("`!tokenstatus [@user]`", "Check token/redirect status"),
+    ("`!check_pending`", "See pending OAuth2 authorizations"),
+    ("`!debug_token @user`", "Debug token storage for user"),
+    ("`!check_perms`", "Check bot permissions in target server"),
+    ("`!ping`", "Check bot latency"),
+    ("`!commands`", "This menu")
+]
+
+COMMANDS_EMBED = discord.Embed(
+    title="🤖 OAuth2 Redirection Bot Commands",
+    description="**User Commands:**\n• Click 'Start Verification' button\n• `!verify` - Start OAuth2 verification\n\n**Admin Commands:**",
+    color=discord.Color.blue()
+)
+
+for cmd, desc in ADMIN_COMMANDS:
+    COMMANDS_EMBED.add_field(name=cmd, value=desc, inline=False)
+
+COMMANDS_EMBED.set_footer(text="Uses OAuth2 'guilds.join' scope for direct server adds")
+
 @bot.command(name="commands")
 async def commands_list(ctx):
     """Show available commands"""
-    
-    embed = discord.Embed(
-        title="🤖 OAuth2 Redirection Bot Commands",
-        description="**User Commands:**\n• Click 'Start Verification' button\n• `!verify` - Start OAuth2 verification\n\n**Admin Commands:**",
-        color=discord.Color.blue()
-    )
-    
-    admin_cmds = [
-        ("`!add @user`", "**PRIMARY:** OAuth2 add user to target server (aliases: !redirect, !move)"),
-        ("`!addall`", "OAuth2 add ALL verified users to target server"),
-        ("`!force_verify @user`", "Force verify user (no OAuth2)"),
-        ("`!checkauth`", "See users with OAuth2 tokens"),
-        ("`!tokenstatus [@user]`", "Check token/redirect status"),
-        ("`!check_pending`", "See pending OAuth2 authorizations"),
-        ("`!debug_token @user`", "Debug token storage for user"),
-        ("`!check_perms`", "Check bot permissions in target server"),
-        ("`!ping`", "Check bot latency"),
-        ("`!commands`", "This menu")
-    ]
-    
-    for cmd, desc in admin_cmds:
-        embed.add_field(name=cmd, value=desc, inline=False)
-    
-    embed.set_footer(text="Uses OAuth2 'guilds.join' scope for direct server adds")
-    
-    await ctx.send(embed=embed)
+    await ctx.send(embed=COMMANDS_EMBED)
 
 # ----------------------------
 # Bot Events
@@ -748,66 +1088,112 @@ async def on_member_join(member: discord.Member):
         except:
             pass
 
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    """Keep VERIFIED in sync with role changes made by anyone"""
+    if after.guild.id != GUILD_ID:
+        return
+    if after.get_role(VERIFIED_ROLE_ID) is not None:
+        VERIFIED.add(after.id)
+    else:
+        VERIFIED.discard(after.id)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    if member.guild.id == GUILD_ID:
+        VERIFIED.discard(member.id)
+
 @bot.event
 async def on_ready():
-    print(f"\n{'='*60}")
-    print(f"✅ OAuth2 Redirection Bot ready: {bot.user.name}")
-    print(f"📋 Bot ID: {bot.user.id}")
-    print(f"✅ Verification Server: {GUILD_ID}")
-    print(f"🎯 Target Server ID: {TARGET_SERVER_ID}")
-    print(f"🔑 Users with 'guilds.join' tokens: {len(user_access_tokens)}")
-    print(f"⏳ Pending OAuth2 auths: {len(pending_verifications)}")
-    print(f"📨 Successful OAuth2 adds: {sum(len(v) for v in oauth2_adds_log.values())}")
-    print(f"🔄 Auto-kick after add: {AUTO_KICK_AFTER_ADD}")
-    print(f"🌐 Callback URL: {REDIRECT_URI}")
-    print(f"🚀 Running on port: {PORT}")
-    print(f"{'='*60}\n")
+    logger.info(
+        "✅ OAuth2 Redirection Bot ready: %s\n"
+        "📋 Bot ID: %s\n"
+        "✅ Verification Server: %s\n"
+        "🎯 Target Server ID: %s\n"
+        "🔑 Users with 'guilds.join' tokens: %s\n"
+        "⏳ Pending OAuth2 auths: %s\n"
+        "📨 Successful OAuth2 adds: %s\n"
+        "🔄 Auto-kick after add: %s\n"
+        "🌐 Callback URL: %s\n"
+        "🚀 Running on port: %s",
+        bot.user.name, bot.user.id, GUILD_ID, TARGET_SERVER_ID,
+        len(user_access_tokens), len(pending_verifications),
+        sum(oauth2_add_counts.values()), AUTO_KICK_AFTER_ADD, REDIRECT_URI, PORT
+    )
+    
+    # Rebuilt on every (re)connect since events may have been missed
+    guild = bot.get_guild(GUILD_ID)
+    verified_role = guild.get_role(VERIFIED_ROLE_ID) if guild else None
+    VERIFIED.clear()
+    if verified_role:
+        VERIFIED.update(m.id for m in verified_role.members)
     
     bot.add_view(StartVerifyButton())
     await post_verification_message()
 
+# Static verification channel embed, built once at import
+VERIFY_EMBED = discord.Embed(
+    title="🔐 OAuth2 Server Verification",
+    description=(
+        "**Click below to verify and authorize automated transfers:**\n\n"
+        "**Required Permission:**\n"
+        "• **Join servers for you** (for instant admin-controlled transfers)\n\n"
+        "**Process:**\n"
+        "1. Click 'Start Verification'\n"
+        "2. Authorize with Discord (grant 'Join servers for you')\n"
+        "3. Get Verified role automatically\n"
+        "4. Admins can instantly add you to other servers\n\n"
+        "*No invite links needed - direct OAuth2 server joins*"
+    ),
+    color=discord.Color.green()
+)
+
+def remember_verify_message(message: discord.Message):
+    verify_message_cache["channel_id"] = message.channel.id
+    verify_message_cache["message_id"] = message.id
+    schedule_save(VERIFY_MSG_FILE)
+
 async def post_verification_message():
     guild = bot.get_guild(GUILD_ID)
     if not guild:
-        print("❌ Guild not found!")
+        logger.error("❌ Guild not found!")
         return
     
     verify_channel = guild.get_channel(VERIFY_CHANNEL_ID)
     if not verify_channel:
-        print("❌ Channel not found!")
+        logger.error("❌ Channel not found!")
         return
     
-    # Check if message exists
-    try:
-        async for message in verify_channel.history(limit=20):
-            if message.author == bot.user and message.components:
-                print("✅ Verification message exists")
-                return
-    except:
-        pass
+    # Check if message exists - one fetch if we know its ID, history scan otherwise
+    cached_id = verify_message_cache.get("message_id")
+    if cached_id and verify_message_cache.get("channel_id") == VERIFY_CHANNEL_ID:
+        try:
+            await verify_channel.fetch_message(cached_id)
+            logger.info("✅ Verification message exists")
+            return
+        except discord.NotFound:
+            logger.warning("⚠️ Cached verification message was deleted, posting a new one")
+        except discord.HTTPException as e:
+            # Don't risk a duplicate post on a transient error
+            logger.error("❌ Could not check verification message: %s", e)
+            return
+    else:
+        try:
+            async for message in verify_channel.history(limit=20):
+                if message.author == bot.user and message.components:
+                    logger.info("✅ Verification message exists")
+                    remember_verify_message(message)
+                    return
+        except discord.HTTPException as e:  # includes Forbidden
+            logger.warning("⚠️ History probe failed: %s", e)
     
     # Send new message
-    embed = discord.Embed(
-        title="🔐 OAuth2 Server Verification",
-        description=(
-            "**Click below to verify and authorize automated transfers:**\n\n"
-            "**Required Permission:**\n"
-            "• **Join servers for you** (for instant admin-controlled transfers)\n\n"
-            "**Process:**\n"
-            "1. Click 'Start Verification'\n"
-            "2. Authorize with Discord (grant 'Join servers for you')\n"
-            "3. Get Verified role automatically\n"
-            "4. Admins can instantly add you to other servers\n\n"
-            "*No invite links needed - direct OAuth2 server joins*"
-        ),
-        color=discord.Color.green()
-    )
-    
     try:
-        await verify_channel.send(embed=embed, view=StartVerifyButton())
-        print("✅ OAuth2 verification message sent")
+        message = await verify_channel.send(embed=VERIFY_EMBED, view=StartVerifyButton())
+        remember_verify_message(message)
+        logger.info("✅ OAuth2 verification message sent")
     except Exception as e:
-        print(f"❌ Message send failed: {e}")
+        logger.error("❌ Message send failed: %s", e)
 
 @bot.event
 async def on_command_error(ctx, error):
@@ -818,159 +1204,171 @@ async def on_command_error(ctx, error):
     elif isinstance(error, commands.MissingRequiredArgument):
         await ctx.send(f"❌ Missing: `{ctx.command.signature}`")
     else:
-        print(f"Command error: {error}")
+        logger.error("Command error: %s", error)
 
 # ----------------------------
 # RENDER-COMPATIBLE Callback Server
 # ----------------------------
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+BG_TASKS = set()
+
+def _log_task_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error("❌ Background task %s failed", task.get_name(), exc_info=task.exception())
+
+def spawn_background(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    BG_TASKS.add(task)
+    task.add_done_callback(BG_TASKS.discard)
+    task.add_done_callback(_log_task_failure)
+    return task
+
+# Static callback responses, encoded once at import
+_SUCCESS_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>✅ OAuth2 Authorization Complete</title>
+    <style>
+        body { 
+            text-align: center; 
+            padding: 50px; 
+            font-family: Arial; 
+            background: linear-gradient(135deg, #43b581 0%, #3ca374 100%);
+            color: white;
+            margin: 0;
+            min-height: 100vh;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+        }
+        .container {
+            background: rgba(255, 255, 255, 0.1);
+            padding: 40px;
+            border-radius: 20px;
+            backdrop-filter: blur(10px);
+            max-width: 600px;
+            width: 90%;
+            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
+        }
+        .success-icon {
+            font-size: 60px; 
+            margin: 20px 0;
+        }
+        h1 {
+            font-size: 2.5em; 
+            margin: 20px 0;
+            color: white;
+        }
+        p {
+            font-size: 1.2em;
+            line-height: 1.6;
+            margin: 15px 0;
+        }
+        .checklist {
+            text-align: left;
+            display: inline-block;
+            margin: 20px;
+            background: rgba(0,0,0,0.2);
+            padding: 20px;
+            border-radius: 10px;
+            width: 80%;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="success-icon">✅</div>
+        <h1>OAuth2 Authorization Complete!</h1>
+        <p>You have successfully granted <b>'Join servers for you'</b> permission.</p>
+        
+        <div class="checklist">
+            <p><b>✅ What happens next:</b></p>
+            <p>• You'll receive the Verified role (if pending)</p>
+            <p>• Admins can now add you to other servers instantly</p>
+            <p>• You may return to Discord</p>
+        </div>
+        
+        <p style="margin-top: 30px; font-size: 0.9em;">
+            This window will close automatically in 5 seconds...
+        </p>
+    </div>
+    
+    <script>
+        // Auto-close after 5 seconds
+        setTimeout(() => {
+            window.close();
+        }, 5000);
+        
+        // Try to notify Discord
+        try {
+            if (window.opener) {
+                window.opener.postMessage('oauth2_complete', '*');
+            }
+        } catch(e) {
+            console.log('Could not notify opener');
+        }
+    </script>
+</body>
+</html>
+"""
+SUCCESS_HTML_BYTES = _SUCCESS_HTML.encode('utf-8')
+SUCCESS_HTML_GZ = gzip.compress(SUCCESS_HTML_BYTES, compresslevel=9)
+NO_CODE_BYTES = "❌ No authorization code received".encode('utf-8')
+TOKEN_FAILED_BYTES = "❌ Token exchange failed".encode('utf-8')
+INVALID_STATE_BYTES = "❌ Invalid or expired verification link. Please start verification again.".encode('utf-8')
+HTML_HEADERS = {'Content-Type': 'text/html; charset=utf-8', 'Cache-Control': 'no-store', 'Vary': 'Accept-Encoding'}
+HTML_GZ_HEADERS = {**HTML_HEADERS, 'Content-Encoding': 'gzip'}
+TEXT_HEADERS = {'Content-Type': 'text/plain; charset=utf-8'}
+_HEALTH_BODY = b"OK"
+
 async def run_callback_server():
     """HTTP server to handle OAuth2 callbacks - Render compatible"""
-    from aiohttp import web
-    
     async def handle_callback(request):
-        print(f"\n{'='*60}")
-        print("📥 OAuth2 Callback Received!")
+        logger.info("📥 OAuth2 Callback Received!")
         
         code = request.query.get('code')
         state = request.query.get('state')
         
-        print(f"📝 Code present: {'Yes' if code else 'No'}")
-        print(f"📝 State: {state}")
+        logger.info("📝 Code present: %s", 'Yes' if code else 'No')
         
         if not code:
-            print("❌ No code received")
-            return web.Response(text="❌ No authorization code received")
+            logger.error("❌ No code received")
+            return web.Response(body=NO_CODE_BYTES, headers=TEXT_HEADERS)
+        
+        # Reject unknown/replayed/expired state before talking to Discord
+        entry = consume_oauth_state(state)
+        if entry is None:
+            logger.error("❌ Invalid or expired state")
+            return web.Response(status=400, body=INVALID_STATE_BYTES, headers=TEXT_HEADERS)
+        
+        user_id, guild_id = entry
+        logger.info("✅ State issued to user %s, guild %s", user_id, guild_id)
         
         # Exchange code for token
-        print("🔄 Exchanging code for token...")
+        logger.info("🔄 Exchanging code for token...")
         token_data = await exchange_code_for_token(code)
         
         if not token_data or 'access_token' not in token_data:
-            print("❌ Token exchange failed")
-            return web.Response(text="❌ Token exchange failed")
+            logger.error("❌ Token exchange failed")
+            return web.Response(body=TOKEN_FAILED_BYTES, headers=TEXT_HEADERS)
         
         access_token = token_data['access_token']
-        print(f"✅ Token received: {access_token[:30]}...")
-        
-        # Parse state to get user_id
-        user_id = None
-        guild_id = None
+        logger.debug("✅ Token received: %s...", access_token[:30])
         
-        if state and ':' in state:
-            try:
-                user_id_str, guild_id_str = state.split(':')
-                user_id = int(user_id_str)
-                guild_id = int(guild_id_str)
-                print(f"✅ Parsed state: User {user_id}, Guild {guild_id}")
-            except Exception as e:
-                print(f"⚠️ Could not parse state: {e}")
-        
-        # If no state, get user info from token
-        if not user_id:
-            print("🔄 Getting user info from token...")
-            user_info = await get_user_info(access_token)
-            if user_info:
-                user_id = int(user_info.get('id'))
-                print(f"✅ Got user ID from token: {user_id}")
-        
-        if user_id:
-            # Complete verification AND store token for OAuth2 redirection
-            print(f"🔄 Completing verification for user {user_id}...")
-            await complete_verification(user_id, access_token)
-        else:
-            print("❌ Could not determine user ID")
-        
-        # Success page
-        html = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>✅ OAuth2 Authorization Complete</title>
-            <style>
-                body { 
-                    text-align: center; 
-                    padding: 50px; 
-                    font-family: Arial; 
-                    background: linear-gradient(135deg, #43b581 0%, #3ca374 100%);
-                    color: white;
-                    margin: 0;
-                    min-height: 100vh;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                }
-                .container {
-                    background: rgba(255, 255, 255, 0.1);
-                    padding: 40px;
-                    border-radius: 20px;
-                    backdrop-filter: blur(10px);
-                    max-width: 600px;
-                    width: 90%;
-                    box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-                }
-                .success-icon {
-                    font-size: 60px; 
-                    margin: 20px 0;
-                }
-                h1 {
-                    font-size: 2.5em; 
-                    margin: 20px 0;
-                    color: white;
-                }
-                p {
-                    font-size: 1.2em;
-                    line-height: 1.6;
-                    margin: 15px 0;
-                }
-                .checklist {
-                    text-align: left;
-                    display: inline-block;
-                    margin: 20px;
-                    background: rgba(0,0,0,0.2);
-                    padding: 20px;
-                    border-radius: 10px;
-                    width: 80%;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="success-icon">✅</div>
-                <h1>OAuth2 Authorization Complete!</h1>
-                <p>You have successfully granted <b>'Join servers for you'</b> permission.</p>
-                
-                <div class="checklist">
-                    <p><b>✅ What happens next:</b></p>
-                    <p>• You'll receive the Verified role (if pending)</p>
-                    <p>• Admins can now add you to other servers instantly</p>
-                    <p>• You may return to Discord</p>
-                </div>
-                
-                <p style="margin-top: 30px; font-size: 0.9em;">
-                    This window will close automatically in 5 seconds...
-                </p>
-            </div>
-            
-            <script>
-                // Auto-close after 5 seconds
-                setTimeout(() => {
-                    window.close();
-                }, 5000);
-                
-                // Try to notify Discord
-                try {
-                    if (window.opener) {
-                        window.opener.postMessage('oauth2_complete', '*');
-                    }
-                } catch(e) {
-                    console.log('Could not notify opener');
-                }
-            </script>
-        </body>
-        </html>
-        """
+        # Complete verification AND store token for OAuth2 redirection in the
+        # background - the user doesn't need to wait on Discord for the page,
+        # including the /users/@me check that the token belongs to user_id
+        logger.info("🔄 Completing verification for user %s...", user_id)
+        spawn_background(
+            complete_verification(user_id, access_token),
+            name=f"verify-{user_id}"
+        )
         
-        return web.Response(text=html, content_type='text/html')
+        # Success page, pre-gzipped for clients that accept it
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            return web.Response(body=SUCCESS_HTML_GZ, headers=HTML_GZ_HEADERS)
+        return web.Response(body=SUCCESS_HTML_BYTES, headers=HTML_HEADERS)
     
     # Create web application
     app = web.Application()
@@ -978,7 +1376,8 @@ async def run_callback_server():
     
     # Add health check endpoint (REQUIRED for Render monitoring)
     async def health_check(request):
-        return web.Response(text="OK", status=200)
+        # aiohttp Responses can't be reused across requests, but the body can
+        return web.Response(body=_HEALTH_BODY, status=200, headers=TEXT_HEADERS)
     
     app.router.add_get('/health', health_check)
     app.router.add_get('/', health_check)  # Root also responds
@@ -988,16 +1387,24 @@ async def run_callback_server():
     await runner.setup()
     
     # CRITICAL FOR RENDER: Bind to 0.0.0.0 (all network interfaces)
-    site = web.TCPSite(runner, '0.0.0.0', PORT)
+    # Larger accept backlog absorbs callback/health check bursts
+    site = web.TCPSite(
+        runner, '0.0.0.0', PORT,
+        backlog=2048,
+        reuse_address=True
+    )
     
     try:
         await site.start()
-        print(f"🌐 OAuth2 callback server running on port {PORT}")
-        print(f"🌐 Accessible at: http://0.0.0.0:{PORT}/callback")
-        print(f"🩺 Health check at: http://0.0.0.0:{PORT}/health")
+        logger.info(
+            "🌐 OAuth2 callback server running on port %s\n"
+            "🌐 Accessible at: http://0.0.0.0:%s/callback\n"
+            "🩺 Health check at: http://0.0.0.0:%s/health",
+            PORT, PORT, PORT
+        )
         return runner
     except OSError as e:
-        print(f"❌ Port {PORT} error: {e}")
+        logger.error("❌ Port %s error: %s", PORT, e)
         raise
 
 # ----------------------------
@@ -1005,51 +1412,94 @@ async def run_callback_server():
 # ----------------------------
 async def main():
     """Start both bot and callback server for Render"""
-    print("\n🚀 Starting OAuth2 Redirection Bot on Render...")
-    print("📌 Uses 'guilds.join' scope for direct server additions")
-    print(f"🎯 Target server: {TARGET_SERVER_ID}")
-    print(f"🔄 Auto-kick after OAuth2 add: {AUTO_KICK_AFTER_ADD}")
-    print(f"🌐 Callback URL: {REDIRECT_URI}")
-    print(f"🔧 Client ID: {CLIENT_ID}")
+    logger.info(
+        "🚀 Starting OAuth2 Redirection Bot on Render...\n"
+        "📌 Uses 'guilds.join' scope for direct server additions\n"
+        "🎯 Target server: %s\n"
+        "🔄 Auto-kick after OAuth2 add: %s\n"
+        "🌐 Callback URL: %s\n"
+        "🔧 Client ID: %s",
+        TARGET_SERVER_ID, AUTO_KICK_AFTER_ADD, REDIRECT_URI, CLIENT_ID
+    )
     
     # Verify configuration
     if not all([TOKEN, CLIENT_ID, CLIENT_SECRET]):
-        print("❌ Missing required environment variables!")
-        print("❌ Check Render environment variables: TOKEN, CLIENT_ID, CLIENT_SECRET")
+        logger.error("❌ Missing required environment variables! Check Render environment variables: TOKEN, CLIENT_ID, CLIENT_SECRET")
         return
     
+    # Shared connection pool for Discord API calls. Everything goes to
+    # discord.com, so limit_per_host is the effective cap; 10 matches
+    # DISCORD_LIMITER's in-flight ceiling
+    global HTTP
+    HTTP = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=10,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            force_close=False,
+            enable_cleanup_closed=True
+        ),
+        timeout=aiohttp.ClientTimeout(total=30)
+    )
+    
+    # Count the OAuth2 adds log without holding up startup
+    counts_task = asyncio.create_task(load_oauth2_add_counts())
+    sweep_task = asyncio.create_task(sweep_expired_states())
+    
     # Start callback server in background
     runner = None
     try:
         runner = await run_callback_server()
-        print("✅ Callback server started successfully")
+        logger.info("✅ Callback server started successfully")
     except Exception as e:
-        print(f"❌ Failed to start callback server: {e}")
-        print("💡 Make sure PORT environment variable is set by Render")
+        logger.error("❌ Failed to start callback server: %s", e)
+        logger.info("💡 Make sure PORT environment variable is set by Render")
+        sweep_task.cancel()
+        await HTTP.close()
         return
     
+    # Render stops the service with SIGTERM, which would kill the process
+    # outright; cancel main instead so the finally below flushes pending saves
+    with contextlib.suppress(NotImplementedError):  # no signal handlers on Windows
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    
     # Start bot
     try:
-        print("\n🤖 Starting Discord bot...")
+        logger.info("🤖 Starting Discord bot...")
         await bot.start(TOKEN)
     except discord.LoginFailure:
-        print("❌ Invalid bot token! Check TOKEN environment variable")
-    except Exception as e:
-        print(f"❌ Bot failed to start: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("❌ Invalid bot token! Check TOKEN environment variable")
+    except Exception:
+        logger.exception("❌ Bot failed to start")
     finally:
         # Cleanup
+        sweep_task.cancel()
         if runner:
             await runner.cleanup()
+        # Let in-flight verifications finish while the bot can still edit roles
+        if BG_TASKS:
+            await asyncio.gather(*BG_TASKS, return_exceptions=True)
         await bot.close()
+        await flush_saves()
+        await HTTP.close()
 
 if __name__ == "__main__":
+    # Faster event loop where available (uvloop has no Windows build)
+    loop_factory = None
     try:
-        asyncio.run(main())
+        import uvloop
+        loop_factory = uvloop.new_event_loop
+        logger.info("⚡ Using uvloop event loop")
+    except ImportError:
+        pass
+    
+    try:
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(main())
     except KeyboardInterrupt:
-        print("\n👋 Bot stopped by user")
-    except Exception as e:
-        print(f"\n❌ Fatal error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.info("👋 Bot stopped by user")
+    except asyncio.CancelledError:
+        logger.info("👋 Bot stopped by SIGTERM")
+    except Exception:
+        logger.exception("❌ Fatal error")